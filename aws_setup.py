@@ -2,8 +2,6 @@ import boto3
 import os
 import typer
 import json
-import logging
-import sys
 
 from configparser import ConfigParser, ExtendedInterpolation
 from resources import *
@@ -16,28 +14,6 @@ with open(f"{os.getcwd()}/resources/default_config.json", "r") as file:
 app = Typer()
 
 
-def make_logger(name: str) -> logging.Logger:
-    """
-    return a logger that prints log messages in defined format
-    """
-    # Define log format to be used in each of handler
-    formatter = logging.Formatter(
-        fmt="%(asctime)s | (%(funcName)s) : %(msg)s",
-        datefmt="%Y-%m-%d %H:%M:%S"
-    )
-
-    # Define handler for console printouts
-    stream_handler = logging.StreamHandler(sys.stdout)
-    stream_handler.setFormatter(formatter)
-
-    # Make logger and attach each of handler to the logger
-    logger = logging.getLogger(name)
-    logger.addHandler(stream_handler)
-    logger.setLevel(logging.INFO)
-
-    return logger
-
-
 @app.command("build-resources")
 def build_resources(
     admin_profile: str = typer.Argument(...),
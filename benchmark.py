@@ -0,0 +1,193 @@
+import boto3
+import copy
+import importlib
+import os
+import psycopg2
+import typer
+import json
+import logging
+import sys
+import time
+
+from contextlib import nullcontext
+from configparser import ConfigParser, ExtendedInterpolation
+from resources import *
+from typer import Typer
+
+
+CONFIG_FILE_PATH = f"{os.getcwd()}/dwh.cfg"
+MATRIX_FILE_PATH = f"{os.getcwd()}/resources/benchmark_matrix.json"
+REPORT_FILE_PATH = f"{os.getcwd()}/benchmark_report.json"
+with open(f"{os.getcwd()}/resources/default_config.json", "r") as file:
+    DEFAULT_CONFIG = json.load(file)
+app = Typer()
+
+
+class LocalCursor:
+    """
+    stand-in of psycopg2 cursor that records statements instead of sending them to Redshift
+    """
+
+    def __init__(self, statements: list):
+        self.statements = statements
+        self.rowcount = 0
+
+    def execute(self, query: str, params: dict = None):
+        self.statements.append(query)
+
+    def fetchall(self) -> list:
+        return []
+
+
+class LocalConnection:
+    """
+    stand-in of psycopg2 connection used by dry runs, so that orchestration can be exercised offline
+    """
+
+    def __init__(self):
+        self.statements = []
+
+    def cursor(self) -> LocalCursor:
+        return LocalCursor(self.statements)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def load_jobs():
+    """
+    import create_tables and etl modules against current configuration file,
+    reloading them since sql_queries reads the file only on import
+    """
+    for name in ["sql_queries", "create_tables", "etl"]:
+        if name in sys.modules:
+            importlib.reload(sys.modules[name])
+        else:
+            importlib.import_module(name)
+
+    return sys.modules["create_tables"], sys.modules["etl"]
+
+
+def run_shape(
+    shape: dict,
+    matrix: dict,
+    admin_profile: str,
+    db_password: str,
+    logger: logging.Logger,
+    dry_run: bool
+) -> dict:
+    """
+    provision cluster of given shape, run table creation and ETL jobs on it, and tear it down
+    """
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    config["DEFAULT"]["admin_profile"] = admin_profile
+    config["cluster"].update(shape)
+    config["s3"].update(matrix.get("dataset", {}))
+    parser = create_config(CONFIG_FILE_PATH, config, ConfigParser(interpolation=ExtendedInterpolation()), logger)
+    session = boto3.Session(
+        profile_name=None if dry_run else admin_profile,
+        region_name=parser.get("DEFAULT", "region")
+    )
+
+    result = {**shape, "status": "succeeded", "error": None, "timings": {}, "load_report": {}}
+    timings = result["timings"]
+    # Resources of moto are ready at once, so dry runs poll cluster status without waiting
+    poll_interval = 0 if dry_run else 5
+    # Resources are marked before creation, so that partially created ones are also torn down
+    attempted = []
+    conn = None
+    started_at = time.perf_counter()
+    try:
+        with measure(timings, "provision"):
+            attempted.append((delete_vpc, {}))
+            parser = create_vpc(parser, logger, session)
+            attempted.append((delete_iam_role, {}))
+            parser = create_iam_role(parser, logger, session)
+            attempted.append((delete_cluster, {"poll_interval": poll_interval}))
+            parser = create_cluster(parser, logger, session, db_password, poll_interval)
+            with open(CONFIG_FILE_PATH, "w") as file:
+                parser.write(file)
+
+        create_tables, etl = load_jobs()
+        conn = LocalConnection() if dry_run else psycopg2.connect(get_db_info(parser))
+        cur = conn.cursor()
+        with measure(timings, "create_tables"):
+            create_tables.run(cur, conn)
+        etl.run(cur, conn, parser, session, logger, result["load_report"], timings)
+    except Exception as error:
+        logger.info(f"Benchmark of {shape} failed: {error!r}")
+        result["status"] = "failed"
+        result["error"] = repr(error)
+    finally:
+        if conn is not None:
+            conn.close()
+        with measure(timings, "teardown"):
+            for delete_resource, options in reversed(attempted):
+                try:
+                    delete_resource(parser, logger, session, **options)
+                except Exception as error:
+                    logger.info(f"Teardown step {delete_resource.__name__} failed, check leftover resources: {error!r}")
+            delete_config(CONFIG_FILE_PATH, logger)
+
+    # Redshift bills per node-second while the cluster runs, so cost is estimated on both whole run and job stages
+    hourly_price = matrix["hourly_price"].get(shape["node_type"], 0) * shape["node_count"]
+    job_seconds = sum(
+        timings.get(stage, 0)
+        for stage in ["create_tables", "load_staging_tables", "insert_tables", "refresh_views"]
+    )
+    result["total_seconds"] = round(time.perf_counter() - started_at, 2)
+    result["job_seconds"] = round(job_seconds, 2)
+    result["estimated_cost"] = round(hourly_price * result["total_seconds"] / 3600, 4)
+    result["job_cost"] = round(hourly_price * job_seconds / 3600, 4)
+
+    return result
+
+
+@app.command("run")
+def run(
+    admin_profile: str = typer.Argument(...),
+    db_password: str = typer.Argument(...),
+    matrix_file_path: str = typer.Option(MATRIX_FILE_PATH, "--matrix"),
+    dry_run: bool = typer.Option(False, "--dry-run")
+):
+    """
+    benchmark table creation and ETL jobs across cluster shapes declared in the matrix file
+    """
+    logger = make_logger(__name__)
+    if os.path.exists(CONFIG_FILE_PATH):
+        logger.info("Configuration file already exists; delete running resources before benchmarking")
+        raise typer.Exit(code=1)
+    with open(matrix_file_path, "r") as file:
+        matrix = json.load(file)
+
+    if dry_run:
+        # moto is only required for dry runs, which replace AWS with in-memory resources
+        from moto import mock_aws
+        for key in ["AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "AWS_SESSION_TOKEN"]:
+            os.environ.setdefault(key, "testing")
+        os.environ.setdefault("MOTO_IAM_LOAD_MANAGED_POLICIES", "true")
+    with mock_aws() if dry_run else nullcontext():
+        results = [
+            run_shape(shape, matrix, admin_profile, db_password, logger, dry_run)
+            for shape in matrix["shapes"]
+        ]
+
+    logger.info("Comparison of cluster shapes, ordered by time spent on jobs")
+    for result in sorted(results, key=lambda result: (result["status"] != "succeeded", result["job_seconds"])):
+        logger.info(
+            f"{result['node_count']} x {result['node_type']}: {result['status']}, "
+            f"jobs {result['job_seconds']}s (${result['job_cost']}), "
+            f"total {result['total_seconds']}s (${result['estimated_cost']})"
+        )
+    with open(REPORT_FILE_PATH, "w") as file:
+        json.dump(results, file, indent=4)
+
+
+if __name__ == "__main__":
+    app()
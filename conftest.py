@@ -0,0 +1,29 @@
+import json
+import os
+import pytest
+
+from configparser import ConfigParser, ExtendedInterpolation
+
+
+ROOT_PATH = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture
+def project_config(tmp_path, monkeypatch) -> ConfigParser:
+    """
+    write configuration file of a provisioned project into temporary working directory,
+    since sql_queries reads dwh.cfg of working directory on import
+    """
+    with open(os.path.join(ROOT_PATH, "resources", "default_config.json"), "r") as file:
+        config = json.load(file)
+    config["DEFAULT"]["admin_profile"] = "homer.simpson"
+    config["iam.role"]["arn"] = "arn:aws:iam::123456789012:role/redshift-s3-readonly"
+    config["cluster"].update({"db_host": "localhost", "db_password": "Doh!nuts123"})
+
+    parser = ConfigParser(interpolation=ExtendedInterpolation())
+    parser.read_dict(config)
+    with open(tmp_path / "dwh.cfg", "w") as file:
+        parser.write(file)
+    monkeypatch.chdir(tmp_path)
+
+    return parser
@@ -1,14 +1,16 @@
 import psycopg2
 
 from configparser import ConfigParser, ExtendedInterpolation
-from sql_queries import create_table_queries, drop_table_queries
+from resources import get_db_info
+from sql_queries import create_table_queries, drop_table_queries, create_view_queries, drop_view_queries, load_version_seed, load_version_bump, versioned_tables
 
 
 def drop_tables(cur, conn):
     """
     execute table deletion jobs as defined in predefined queries
     """
-    for query in drop_table_queries:
+    # Materialized views depend on tables, so they have to be dropped first
+    for query in drop_view_queries + drop_table_queries:
         cur.execute(query)
         conn.commit()
 
@@ -17,26 +19,38 @@ def create_tables(cur, conn):
     """
     execute table creation jobs as defined in predefined queries
     """
-    for query in create_table_queries:
+    for query in create_table_queries + create_view_queries:
         cur.execute(query)
         conn.commit()
 
 
+def reset_load_versions(cur, conn):
+    """
+    bump load version of every recreated table so that previously cached query results become invalid
+    """
+    for table in versioned_tables:
+        cur.execute(load_version_seed, {"table_name": table})
+        cur.execute(load_version_bump, {"table_name": table})
+    conn.commit()
+
+
+def run(cur, conn):
+    """
+    recreate every table and materialized view, and reset their load versions
+    """
+    drop_tables(cur, conn)
+    create_tables(cur, conn)
+    reset_load_versions(cur, conn)
+
+
 def main():
     parser = ConfigParser(interpolation=ExtendedInterpolation())
     parser.read('dwh.cfg')
 
-    db_host = parser.get("cluster", "db_host")
-    db_name = parser.get("cluster", "db_name")
-    db_user = parser.get("cluster", "db_user")
-    db_password = parser.get("cluster", "db_password")
-    db_port = parser.get("cluster", "db_port")
-    db_info = f"host={db_host} dbname={db_name} user={db_user} password={db_password} port={db_port}"
-    conn = psycopg2.connect(db_info)
+    conn = psycopg2.connect(get_db_info(parser))
     cur = conn.cursor()
 
-    drop_tables(cur, conn)
-    create_tables(cur, conn)
+    run(cur, conn)
 
     conn.close()
 
@@ -1,45 +1,217 @@
+import boto3
 import psycopg2
+import json
+import logging
+import re
+import time
 
 from configparser import ConfigParser, ExtendedInterpolation
-from sql_queries import copy_table_queries, insert_table_queries
+from resources import get_db_info, make_logger, measure
+from sql_queries import copy_table_queries, insert_table_queries, materialized_views, materialized_view_refresh, load_version_bump, load_errors_select, copy_default_sources
 
 
-def load_staging_tables(cur, conn):
+LOAD_REPORT_PATH = "load_report.json"
+
+
+def get_target_table(query: str) -> str | None:
+    """
+    return name of the table modified by given COPY/INSERT/UPDATE/DELETE query
+    """
+    match = re.match(r"\s*(?:COPY|INSERT\s+INTO|UPDATE|DELETE\s+FROM)\s+(\w+)", query, re.IGNORECASE)
+    return match.group(1).lower() if match else None
+
+
+def copy_table(cur, conn, query: str, source: str, manifest: bool = False) -> bool:
+    """
+    execute COPY from given S3 prefix or manifest file and return whether it succeeded
+    """
+    try:
+        cur.execute(query.format(source=source, manifest="MANIFEST" if manifest else ""))
+        cur.execute(load_version_bump, {"table_name": get_target_table(query)})
+        conn.commit()
+    except psycopg2.Error:
+        conn.rollback()
+        return False
+
+    return True
+
+
+def fetch_load_errors(cur, last_query: int) -> list:
+    """
+    return rows of STL_LOAD_ERRORS raised by COPY commands of current session after given query ID
+    """
+    cur.execute(load_errors_select, {"last_query": last_query})
+    columns = ["query", "filename", "line_number", "column", "error_code", "error_reason", "raw_value"]
+
+    return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+
+def list_source_files(session: boto3.Session, source: str) -> list:
+    """
+    return S3 URL of every file under given S3 prefix
+    """
+    bucket, _, prefix = source.removeprefix("s3://").partition("/")
+    paginator = session.client("s3").get_paginator("list_objects_v2")
+
+    return [
+        f"s3://{bucket}/{content['Key']}"
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix)
+        for content in page.get("Contents", [])
+    ]
+
+
+def write_manifest(session: boto3.Session, manifest_url: str, files: list) -> str:
+    """
+    upload COPY manifest listing given files to manifest_url and return the URL
+    """
+    bucket, _, key = manifest_url.removeprefix("s3://").partition("/")
+    manifest = {"entries": [{"url": file, "mandatory": True} for file in files]}
+    session.client("s3").put_object(Bucket=bucket, Key=key, Body=json.dumps(manifest).encode())
+
+    return manifest_url
+
+
+def load_staging_tables(cur, conn, parser: ConfigParser, session: boto3.Session, logger: logging.Logger, report: dict):
     """
-    execute data insertion jobs into fact tables as defined in predefined queries
+    execute data insertion jobs into fact tables as defined in predefined queries,
+    retry files that failed the whole COPY through manifest files and record load errors into report
     """
+    last_query = 0
     for query in copy_table_queries:
-        cur.execute(query)
+        table = get_target_table(query)
+        source = parser.get(f"copy.{table}", "source", fallback=copy_default_sources[table])
+        manifest_prefix = parser.get(f"copy.{table}", "manifest_prefix", fallback="").rstrip("/")
+
+        logger.info(f"Copy {source} into {table}")
+        succeeded = copy_table(cur, conn, query, source)
+        errors = fetch_load_errors(cur, last_query)
+        last_query = max([last_query] + [error["query"] for error in errors])
+        failed_files = sorted({error["filename"] for error in errors})
+        report[table] = {
+            "status": "loaded" if succeeded else "failed",
+            "errors": errors,
+            "retried_files": [],
+            "rejected_files": [] if succeeded else failed_files,
+        }
+        if succeeded:
+            logger.info(f"Loaded {table} with {len(errors)} rows skipped")
+            continue
+        if not failed_files:
+            raise RuntimeError(f"COPY into {table} failed without any load error recorded")
+        if not manifest_prefix:
+            logger.info(f"Failed to load {table} due to {len(failed_files)} files, and no manifest_prefix is set to retry")
+            continue
+
+        # MAXERROR aborts COPY before every bad file is reached, so remaining files are retried
+        # until a COPY succeeds or fails without revealing any new failed file
+        source_files = list_source_files(session, source)
+        while True:
+            remaining_files = [file for file in source_files if file not in failed_files]
+            if not remaining_files:
+                break
+            logger.info(f"Retry loading {table} without {len(failed_files)} failed files")
+            manifest_url = write_manifest(session, f"{manifest_prefix}/{table}/remaining.manifest", remaining_files)
+            succeeded = copy_table(cur, conn, query, manifest_url, manifest=True)
+            errors = fetch_load_errors(cur, last_query)
+            last_query = max([last_query] + [error["query"] for error in errors])
+            report[table]["errors"] += errors
+            if succeeded:
+                break
+            new_failed_files = {error["filename"] for error in errors} - set(failed_files)
+            if not new_failed_files:
+                raise RuntimeError(f"COPY into {table} failed without revealing any new failed file")
+            failed_files = sorted(set(failed_files) | new_failed_files)
+            report[table]["rejected_files"] = failed_files
+
+        report[table]["status"] = "partial"
+        report[table]["rejected_files"] = []
+        for index, file in enumerate(failed_files):
+            manifest_url = write_manifest(session, f"{manifest_prefix}/{table}/retry-{index}.manifest", [file])
+            if copy_table(cur, conn, query, manifest_url, manifest=True):
+                report[table]["retried_files"].append(file)
+            else:
+                report[table]["rejected_files"].append(file)
+        errors = fetch_load_errors(cur, last_query)
+        last_query = max([last_query] + [error["query"] for error in errors])
+        report[table]["errors"] += errors
+        if not report[table]["rejected_files"]:
+            report[table]["status"] = "loaded"
+        logger.info(f"Loaded {table} with {len(report[table]['rejected_files'])} files rejected")
+
+
+def insert_tables(cur, conn) -> set:
+    """
+    execute data insertion jobs into dimension tables as defined in predefined queries, one transaction per job,
+    and return names of the tables that actually received rows
+    """
+    changed_tables = set()
+    for queries in insert_table_queries:
+        # Load version of a table is bumped once per transaction, even if several of its statements changed rows
+        job_tables = set()
+        for query in queries:
+            cur.execute(query)
+            table = get_target_table(query)
+            if table is not None and cur.rowcount > 0:
+                job_tables.add(table)
+        for table in sorted(job_tables):
+            cur.execute(load_version_bump, {"table_name": table})
         conn.commit()
+        changed_tables |= job_tables
+
+    return changed_tables
 
 
-def insert_tables(cur, conn):
+def refresh_views(cur, conn, changed_tables: set, logger: logging.Logger):
     """
-    execute data insertion jobs into dimension tables as defined in predefined queries
+    refresh materialized views whose base tables have been changed in current run,
+    bumping load version of each view in the same transaction
     """
-    for query in insert_table_queries:
-        cur.execute(query)
+    for view, base_tables in materialized_views.items():
+        if changed_tables.isdisjoint(base_tables):
+            logger.info(f"Skip refreshing {view} since its base tables are unchanged")
+            continue
+        started_at = time.perf_counter()
+        cur.execute(materialized_view_refresh.format(view))
+        cur.execute(load_version_bump, {"table_name": view})
         conn.commit()
+        logger.info(f"Refreshed {view} in {time.perf_counter() - started_at:.2f} seconds")
+
+
+def run(cur, conn, parser: ConfigParser, session: boto3.Session, logger: logging.Logger, report: dict, timings: dict):
+    """
+    execute every ETL stage, recording load errors into report and seconds spent on each stage into timings
+    """
+    with measure(timings, "load_staging_tables"):
+        load_staging_tables(cur, conn, parser, session, logger, report)
+    with measure(timings, "insert_tables"):
+        changed_tables = insert_tables(cur, conn)
+    with measure(timings, "refresh_views"):
+        refresh_views(cur, conn, changed_tables, logger)
 
 
 def main():
     parser = ConfigParser(interpolation=ExtendedInterpolation())
     parser.read('dwh.cfg')
+    logger = make_logger(__name__)
 
-    db_host = parser.get("cluster", "db_host")
-    db_name = parser.get("cluster", "db_name")
-    db_user = parser.get("cluster", "db_user")
-    db_password = parser.get("cluster", "db_password")
-    db_port = parser.get("cluster", "db_port")
-    db_info = f"host={db_host} dbname={db_name} user={db_user} password={db_password} port={db_port}"
-    conn = psycopg2.connect(db_info)
+    session = boto3.Session(
+        profile_name=parser.get("DEFAULT", "admin_profile"), 
+        region_name=parser.get("DEFAULT", "region")
+    )
+    conn = psycopg2.connect(get_db_info(parser))
     cur = conn.cursor()
     
-    load_staging_tables(cur, conn)
-    insert_tables(cur, conn)
-
-    conn.close()
+    # Report is written even when loading stops halfway, so that failed files can be inspected
+    report, timings = {}, {}
+    try:
+        run(cur, conn, parser, session, logger, report, timings)
+    finally:
+        with open(LOAD_REPORT_PATH, "w") as file:
+            json.dump(report, file, indent=4)
+        conn.close()
+    for stage, seconds in timings.items():
+        logger.info(f"Finished {stage} in {seconds:.2f} seconds")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
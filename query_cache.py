@@ -0,0 +1,345 @@
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import psycopg2
+import re
+import sys
+
+from collections import OrderedDict
+from configparser import ConfigParser
+from decimal import Decimal
+from resources import get_db_info
+from sql_queries import load_version_select, versioned_tables
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    collapse whitespace and letter case of given query, leaving quoted literals and identifiers untouched
+    """
+    parts = re.split(r"""('(?:[^']|'')*'|"[^"]*")""", sql.strip().rstrip(";").strip())
+    return "".join(
+        part if index % 2 else re.sub(r"\s+", " ", part).lower()
+        for index, part in enumerate(parts)
+    )
+
+
+# Alias following an item of FROM list, which must not be a keyword continuing the query
+ALIAS_PATTERN = re.compile(
+    r"(?:\s+(?:as\s+)?(?!(?:where|join|inner|left|right|full|outer|cross|natural|on|using|"
+    r"group|order|having|limit|offset|union|intersect|except|minus|qualify|window)\b)\w+)?"
+)
+RELATION_PATTERN = re.compile(r'\s*([\w."]+)')
+COMMA_PATTERN = re.compile(r"\s*,")
+# Functions returning a different value on every call, which make results of a query uncacheable
+VOLATILE_PATTERN = re.compile(
+    r"\b(?:getdate|sysdate|now|timeofday|current_date|current_time|current_timestamp|localtime|localtimestamp|"
+    r"random)\b"
+)
+# Keywords of statements writing data or schema, which QueryCache never runs even after a leading SELECT or WITH
+WRITE_PATTERN = re.compile(r"\b(?:into|insert|update|delete|merge|create|alter|drop|truncate|grant|revoke)\b")
+
+
+def skip_parentheses(sql: str, position: int) -> int:
+    """
+    return position right after the parenthesized block opening at given position
+    """
+    depth = 0
+    for index in range(position, len(sql)):
+        if sql[index] == "(":
+            depth += 1
+        elif sql[index] == ")":
+            depth -= 1
+            if depth == 0:
+                return index + 1
+
+    return len(sql)
+
+
+def get_relations(scanned_sql: str) -> list:
+    """
+    return every relation named after FROM or JOIN, including the ones listed with commas after the first
+    """
+    relations = []
+    for match in re.finditer(r"\b(?:from|join)\b", scanned_sql):
+        position = match.end()
+        while True:
+            position = len(scanned_sql) - len(scanned_sql[position:].lstrip())
+            if scanned_sql.startswith("(", position):
+                # Relations within subquery are picked up on their own FROM keyword
+                position = skip_parentheses(scanned_sql, position)
+                position = ALIAS_PATTERN.match(scanned_sql, position).end()
+            else:
+                relation = RELATION_PATTERN.match(scanned_sql, position)
+                if relation is None:
+                    break
+                relations.append(relation.group(1))
+                position = ALIAS_PATTERN.match(scanned_sql, relation.end()).end()
+            comma = COMMA_PATTERN.match(scanned_sql, position)
+            if comma is None:
+                break
+            position = comma.end()
+
+    return relations
+
+
+def strip_literals(normalized_sql: str) -> str:
+    """
+    replace string literals and quoted identifiers of given query with empty ones, so that their content is never scanned
+    """
+    return re.sub(r"""(?:'(?:[^']|'')*'|"[^"]*")""", "''", normalized_sql)
+
+
+def check_select(normalized_sql: str):
+    """
+    raise ValueError unless given query is a single statement reading data with SELECT or WITH
+    """
+    scanned_sql = strip_literals(normalized_sql)
+    if not re.match(r"(?:select|with)\b", scanned_sql):
+        raise ValueError(f"QueryCache only runs SELECT or WITH queries, got: {normalized_sql}")
+    if ";" in scanned_sql:
+        raise ValueError(f"QueryCache only runs a single statement at a time, got: {normalized_sql}")
+    if WRITE_PATTERN.search(scanned_sql):
+        raise ValueError(f"QueryCache only runs queries that do not write data, got: {normalized_sql}")
+
+
+def get_source_tables(normalized_sql: str) -> set | None:
+    """
+    return versioned tables read by given query, or None if it reads any relation that is not versioned
+    or calls a volatile function
+    """
+    # Literals and functions taking FROM keyword as an argument would be mistaken for relations
+    scanned_sql = re.sub(r"'(?:[^']|'')*'", "''", normalized_sql)
+    if VOLATILE_PATTERN.search(scanned_sql):
+        return None
+    scanned_sql = re.sub(r"\b(?:extract|trim|substring|position)\s*\([^()]*\)", "", scanned_sql)
+    cte_names = set(re.findall(r"(\w+)\s+as\s*\(", scanned_sql))
+    source_tables = set()
+    for relation in get_relations(scanned_sql):
+        relation = relation.split(".")[-1].strip('"').lower()
+        if relation in versioned_tables:
+            source_tables.add(relation)
+        elif relation not in cte_names:
+            return None
+
+    return source_tables
+
+
+# Values fetched by psycopg2 which JSON cannot hold, with functions turning them into JSON values and back
+JSON_TYPES = {bool, int, float, str}
+COLUMN_ENCODERS = {
+    Decimal: ("decimal", str),
+    datetime.datetime: ("datetime", datetime.datetime.isoformat),
+    datetime.date: ("date", datetime.date.isoformat),
+    datetime.time: ("time", datetime.time.isoformat),
+    datetime.timedelta: ("timedelta", datetime.timedelta.total_seconds),
+}
+COLUMN_DECODERS = {
+    "decimal": Decimal,
+    "datetime": datetime.datetime.fromisoformat,
+    "date": datetime.date.fromisoformat,
+    "time": datetime.time.fromisoformat,
+    "timedelta": lambda seconds: datetime.timedelta(seconds=seconds),
+}
+
+
+def encode_column(values: tuple) -> tuple[str, list] | None:
+    """
+    return type name and JSON values of given column, or None if the column holds values JSON cannot represent
+    """
+    value_types = {type(value) for value in values if value is not None}
+    if value_types <= JSON_TYPES:
+        return "json", list(values)
+    if len(value_types) > 1 or next(iter(value_types)) not in COLUMN_ENCODERS:
+        return None
+    type_name, encode = COLUMN_ENCODERS[next(iter(value_types))]
+
+    return type_name, [None if value is None else encode(value) for value in values]
+
+
+def decode_column(type_name: str, values: list) -> list:
+    """
+    turn JSON values of a column back into values of given type name
+    """
+    if type_name == "json":
+        return values
+    decode = COLUMN_DECODERS[type_name]
+
+    return [None if value is None else decode(value) for value in values]
+
+
+def estimate_size(rows: list) -> int:
+    """
+    return approximate number of bytes taken by fetched rows in memory
+    """
+    return sys.getsizeof(rows) + sum(
+        sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+        for row in rows
+    )
+
+
+class QueryCache:
+    """
+    client-side cache of SELECT results over the warehouse, which stays valid until etl.py loads any of the queried tables
+    """
+
+    def __init__(self, parser: ConfigParser, max_bytes: int = None, cache_dir: str = None):
+        self.max_bytes = max_bytes if max_bytes is not None else parser.getint("cache", "max_bytes", fallback=67108864)
+        self.cache_dir = cache_dir if cache_dir is not None else parser.get("cache", "dir", fallback="")
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+        self.entries = OrderedDict()
+        self.size = 0
+
+        # Every statement has to see latest committed load versions, so implicit transactions are disabled
+        self.conn = psycopg2.connect(get_db_info(parser))
+        self.conn.autocommit = True
+
+    def query(self, sql: str, params: dict | tuple = None) -> tuple[list, list]:
+        """
+        return column names and rows of given query, from cache if none of its tables has been loaded since
+        """
+        normalized_sql = normalize_sql(sql)
+        check_select(normalized_sql)
+        source_tables = get_source_tables(normalized_sql)
+        if not source_tables:
+            return self.execute(sql, params)
+
+        key = hashlib.sha256(f"{normalized_sql}\x00{params!r}".encode()).hexdigest()
+        versions = self.get_versions(source_tables)
+        entry = self.entries.get(key) or self.read_entry(key)
+        if entry is not None and entry["versions"] == versions:
+            self.store(key, entry)
+            return entry["columns"], entry["rows"]
+        if entry is not None:
+            self.delete_entry(key)
+
+        columns, rows = self.execute(sql, params)
+        entry = {"versions": versions, "columns": columns, "rows": rows, "size": estimate_size(rows)}
+        self.store(key, entry)
+        self.write_entry(key, entry)
+
+        return columns, rows
+
+    def execute(self, sql: str, params: dict | tuple = None) -> tuple[list, list]:
+        """
+        run given query against the warehouse
+        """
+        with self.conn.cursor() as cur:
+            cur.execute(sql, params)
+            columns = [column.name for column in cur.description]
+            rows = cur.fetchall()
+
+        return columns, rows
+
+    def get_versions(self, tables: set) -> tuple:
+        """
+        return current load versions of given tables in comparable form
+        """
+        with self.conn.cursor() as cur:
+            cur.execute(load_version_select, {"table_names": tuple(sorted(tables))})
+            versions = dict(cur.fetchall())
+
+        return tuple((table, versions.get(table, 0)) for table in sorted(tables))
+
+    def store(self, key: str, entry: dict):
+        """
+        put entry as most recently used one and evict least recently used ones beyond memory limit
+        """
+        if key in self.entries:
+            self.size -= self.entries.pop(key)["size"]
+        if entry["size"] > self.max_bytes:
+            return
+        self.entries[key] = entry
+        self.size += entry["size"]
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= evicted["size"]
+
+    def delete_entry(self, key: str):
+        """
+        drop stale entry from memory and disk
+        """
+        if key in self.entries:
+            self.size -= self.entries.pop(key)["size"]
+        if self.cache_dir:
+            try:
+                os.remove(os.path.join(self.cache_dir, f"{key}.json.gz"))
+            except FileNotFoundError:
+                pass
+
+    def read_entry(self, key: str) -> dict | None:
+        """
+        load entry persisted on disk, turning its columns back into rows
+        """
+        if not self.cache_dir:
+            return None
+        file_path = os.path.join(self.cache_dir, f"{key}.json.gz")
+        try:
+            with gzip.open(file_path, "rt") as file:
+                persisted = json.load(file)
+            columns = [decode_column(type_name, values) for type_name, values in persisted["values"]]
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, ValueError, KeyError, TypeError):
+            self.delete_entry(key)
+            return None
+        # Modification time marks last use of the file, which decides eviction order on disk
+        os.utime(file_path)
+        rows = list(zip(*columns))
+
+        return {
+            "versions": tuple(tuple(version) for version in persisted["versions"]),
+            "columns": persisted["columns"],
+            "rows": rows,
+            "size": estimate_size(rows),
+        }
+
+    def write_entry(self, key: str, entry: dict):
+        """
+        persist entry on disk as gzip-compressed JSON with values stored column by column,
+        which compresses better than rows, and evict least recently used files beyond max_bytes
+        """
+        if not self.cache_dir:
+            return
+        values = [encode_column(column) for column in zip(*entry["rows"])]
+        if None in values:
+            return
+        persisted = {"versions": entry["versions"], "columns": entry["columns"], "values": values}
+
+        # Write into temporary file first so that other processes never read a half-written entry
+        file_path = os.path.join(self.cache_dir, f"{key}.json.gz")
+        with gzip.open(f"{file_path}.{os.getpid()}", "wt") as file:
+            json.dump(persisted, file)
+        os.replace(f"{file_path}.{os.getpid()}", file_path)
+        self.trim_disk()
+
+    def trim_disk(self):
+        """
+        delete least recently used files of cache directory until their total size fits in max_bytes
+        """
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(".json.gz"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+        total_size = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total_size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+    def close(self):
+        """
+        close connection to the warehouse, keeping entries persisted on disk for other clients
+        """
+        self.conn.close()
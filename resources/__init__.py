@@ -1,6 +1,8 @@
-from .config import create_config, delete_config
+from .config import create_config, delete_config, get_db_info
 from .iam import create_iam_role, delete_iam_role
+from .logger import make_logger
 from .redshift import create_cluster, delete_cluster
+from .timer import measure
 from .vpc import create_vpc, delete_vpc
 
 
@@ -13,4 +15,7 @@ __all__ = [
     "delete_iam_role",
     "delete_cluster",
     "delete_vpc",
-]
\ No newline at end of file
+    "get_db_info",
+    "make_logger",
+    "measure",
+]
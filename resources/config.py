@@ -30,3 +30,15 @@ def delete_config(config_file_path: str, logger: logging.Logger):
     logger.info("Delete configuration file from project folder")
     os.remove(config_file_path)
 
+
+def get_db_info(parser: ConfigParser) -> str:
+    """
+    return connection string of Redshift cluster defined in configuration file
+    """
+    db_host = parser.get("cluster", "db_host")
+    db_name = parser.get("cluster", "db_name")
+    db_user = parser.get("cluster", "db_user")
+    db_password = parser.get("cluster", "db_password")
+    db_port = parser.get("cluster", "db_port")
+
+    return f"host={db_host} dbname={db_name} user={db_user} password={db_password} port={db_port}"
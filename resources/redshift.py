@@ -9,10 +9,11 @@ def create_cluster(
     parser: ConfigParser, 
     logger: logging.Logger, 
     session: boto3.Session,
-    db_password: str
+    db_password: str,
+    poll_interval: float = 5
 ) -> ConfigParser:
     """
-    define subnet group and create Redshift cluster
+    define subnet group and create Redshift cluster, checking its status every poll_interval seconds
     """
     redshift_client = session.client("redshift")
 
@@ -43,6 +44,7 @@ def create_cluster(
         PubliclyAccessible=True,
         EnhancedVpcRouting=False,
         VpcSecurityGroupIds=[parser.get("network.vpc", "sg_id")],
+        IamRoles=[parser.get("iam.role", "arn")],
     )
     
     logger.info("Waiting for cluster to be available")
@@ -52,15 +54,9 @@ def create_cluster(
             ClusterIdentifier=parser.get("cluster", "identifier")
         )["Clusters"][0]
         cluster_status = cluster_info["ClusterStatus"]
-        time.sleep(5)
+        time.sleep(poll_interval)
 
-    logger.info("Associate IAM role to the cluster")
-    redshift_client.modify_cluster_iam_roles(
-        ClusterIdentifier=parser.get("cluster", "identifier"), 
-        AddIamRoles=[parser.get("iam.role", "arn")]
-    )
-
-    logger.info("Waiting for IAM role to be applied to the cluster")
+    logger.info("Waiting for IAM role associated on creation to be applied to the cluster")
     apply_status = "adding"
     while apply_status != "in-sync":
         cluster_info = [
@@ -69,7 +65,7 @@ def create_cluster(
             if cluster["ClusterIdentifier"] == parser.get("cluster", "identifier")
         ][0]
         apply_status = cluster_info["IamRoles"][0]["ApplyStatus"]
-        time.sleep(5)
+        time.sleep(poll_interval)
     
     logger.info("Save DB host information in configuration file")
     parser["cluster"]["db_password"] = db_password
@@ -82,28 +78,34 @@ def delete_cluster(
     parser: ConfigParser, 
     logger: logging.Logger, 
     session: boto3.Session,
+    poll_interval: float = 5
 ) -> None:
     """
-    delete Redshift cluster and predefined subnet group
+    delete Redshift cluster and predefined subnet group, checking cluster status every poll_interval seconds
     """
     redshift_client = session.client("redshift")
 
     # Cluster
     logger.info("Delete Redshift cluster")
-    redshift_client.delete_cluster(
-        ClusterIdentifier=parser.get("cluster", "identifier"),
-        SkipFinalClusterSnapshot=True
-    )
-    logger.info("Waiting for cluster to be deleted")
-    cluster_status = "deleting"
-    while cluster_status == "deleting":
-        time.sleep(5)
-        try:
-            redshift_client.describe_clusters(
-                ClusterIdentifier=parser.get("cluster", "identifier")
-            )
-        except redshift_client.exceptions.ClusterNotFoundFault:
-            cluster_status = "deleted" 
+    try:
+        redshift_client.delete_cluster(
+            ClusterIdentifier=parser.get("cluster", "identifier"),
+            SkipFinalClusterSnapshot=True
+        )
+    except redshift_client.exceptions.ClusterNotFoundFault:
+        # Cluster creation may have failed after its subnet group was created
+        logger.info("Cluster does not exist, skip waiting for its deletion")
+    else:
+        logger.info("Waiting for cluster to be deleted")
+        cluster_status = "deleting"
+        while cluster_status == "deleting":
+            time.sleep(poll_interval)
+            try:
+                redshift_client.describe_clusters(
+                    ClusterIdentifier=parser.get("cluster", "identifier")
+                )
+            except redshift_client.exceptions.ClusterNotFoundFault:
+                cluster_status = "deleted" 
     
     # Cluster subnet group
     logger.info("Delete corresponding subnet group")
@@ -0,0 +1,15 @@
+import time
+
+from contextlib import contextmanager
+
+
+@contextmanager
+def measure(timings: dict, stage: str):
+    """
+    record seconds spent within the block as timing of given stage
+    """
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = round(time.perf_counter() - started_at, 2)
@@ -14,6 +14,13 @@ user_table_drop = "DROP TABLE IF EXISTS users"
 song_table_drop = "DROP TABLE IF EXISTS songs"
 artist_table_drop = "DROP TABLE IF EXISTS artists"
 time_table_drop = "DROP TABLE IF EXISTS time"
+user_changes_table_drop = "DROP TABLE IF EXISTS user_changes"
+
+# DROP MATERIALIZED VIEWS
+
+hourly_plays_view_drop = "DROP MATERIALIZED VIEW IF EXISTS hourly_plays"
+song_plays_view_drop = "DROP MATERIALIZED VIEW IF EXISTS song_plays"
+level_activity_view_drop = "DROP MATERIALIZED VIEW IF EXISTS level_activity"
 
 # CREATE TABLES
 
@@ -60,6 +67,7 @@ CREATE TABLE IF NOT EXISTS songplays (
     songplay_id INT IDENTITY(0, 1) PRIMARY KEY, -- act as SERIAL type of pure postgresql
     start_time TIMESTAMP,
     user_id INT,
+    user_key INT, -- version of users row which was effective at start_time
     level VARCHAR,
     song_id VARCHAR,
     artist_id VARCHAR,
@@ -71,11 +79,16 @@ CREATE TABLE IF NOT EXISTS songplays (
 
 user_table_create = """
 CREATE TABLE IF NOT EXISTS users (
-    user_id INT PRIMARY KEY,
+    user_key INT IDENTITY(0, 1) PRIMARY KEY,
+    user_id INT NOT NULL,
     first_name VARCHAR,
     last_name VARCHAR,
     gender CHAR(1),
-    level VARCHAR
+    level VARCHAR,
+    row_hash CHAR(32) NOT NULL, -- MD5 of tracked attributes, used to detect changes
+    effective_from TIMESTAMP NOT NULL,
+    effective_to TIMESTAMP NOT NULL,
+    is_current BOOLEAN NOT NULL
 );
 """
 
@@ -111,28 +124,147 @@ CREATE TABLE IF NOT EXISTS time (
 );
 """
 
+load_version_table_create = """
+CREATE TABLE IF NOT EXISTS load_versions (
+    table_name VARCHAR PRIMARY KEY,
+    version BIGINT NOT NULL,
+    loaded_at TIMESTAMP NOT NULL
+);
+"""
+
+# CREATE MATERIALIZED VIEWS
+# Definitions only use inner joins and COUNT/SUM aggregates without DISTINCT,
+# so that Redshift can refresh them incrementally instead of recomputing from scratch.
+# Auto refresh is turned off, since views are refreshed by etl.py together with their load versions
+
+hourly_plays_view_create = """
+CREATE MATERIALIZED VIEW hourly_plays
+AUTO REFRESH NO
+AS
+SELECT t.year, 
+       t.month, 
+       t.day, 
+       t.hour, 
+       COUNT(*) AS play_count
+FROM songplays AS sp INNER JOIN time AS t
+ON sp.start_time = t.start_time
+GROUP BY t.year, t.month, t.day, t.hour
+"""
+
+song_plays_view_create = """
+CREATE MATERIALIZED VIEW song_plays
+AUTO REFRESH NO
+AS
+SELECT s.song_id, 
+       s.title, 
+       s.artist_id, 
+       COUNT(*) AS play_count
+FROM songplays AS sp INNER JOIN songs AS s
+ON sp.song_id = s.song_id
+GROUP BY s.song_id, s.title, s.artist_id
+"""
+
+level_activity_view_create = """
+CREATE MATERIALIZED VIEW level_activity
+AUTO REFRESH NO
+AS
+SELECT sp.level, 
+       u.gender, 
+       COUNT(*) AS play_count
+FROM songplays AS sp INNER JOIN users AS u
+ON sp.user_key = u.user_key
+GROUP BY sp.level, u.gender
+"""
+
+# LOAD VERSIONS
+# each table carries a counter bumped in the same transaction that loads it,
+# which lets clients tell whether cached query results are still valid
+
+load_version_seed = """
+INSERT INTO load_versions (table_name, version, loaded_at)
+SELECT %(table_name)s, 0, GETDATE()
+WHERE NOT EXISTS (SELECT 1 FROM load_versions WHERE table_name = %(table_name)s)
+"""
+
+load_version_bump = """
+UPDATE load_versions
+SET version = version + 1, loaded_at = GETDATE()
+WHERE table_name = %(table_name)s
+"""
+
+load_version_select = """
+SELECT table_name, version
+FROM load_versions
+WHERE table_name IN %(table_names)s
+"""
+
+# REFRESH MATERIALIZED VIEWS
+
+materialized_view_refresh = "REFRESH MATERIALIZED VIEW {}"
+
 # STAGING TABLES
+# {source} is filled with S3 prefix of the source, or with URL of manifest file together with {manifest} keyword.
+# Fallbacks match default_config.json, for configuration files created before copy sections were introduced.
+# COMPUPDATE is left to Redshift unless configured, which analyzes compression only while the table is empty
+
+def copy_option(section: str, option: str) -> str:
+    """
+    return given option of COPY as configured in the section, or nothing to leave it to Redshift default
+    """
+    value = parser.get(section, option, fallback='')
+
+    return f"{option.upper()} {value}" if value else ''
+
+
+copy_default_sources = {
+    "staging_events": parser.get('s3', 'log_data'),
+    "staging_songs": parser.get('s3', 'song_data'),
+}
 
 staging_events_copy = f"""
 COPY staging_events
-FROM '{parser.get('s3', 'log_data')}'
+FROM '{{source}}'
 IAM_ROLE '{parser.get('iam.role', 'arn')}'
 JSON '{parser.get('s3', 'log_jsonpath')}'
+MAXERROR {parser.getint('copy.staging_events', 'maxerror', fallback=10)}
+{copy_option('copy.staging_events', 'compupdate')}
+STATUPDATE {parser.get('copy.staging_events', 'statupdate', fallback='OFF')}
+{{manifest}}
 """
 
 staging_songs_copy = f"""
 COPY staging_songs
-FROM '{parser.get('s3', 'song_data')}'
+FROM '{{source}}'
 IAM_ROLE '{parser.get('iam.role', 'arn')}'
 JSON 'auto'
+MAXERROR {parser.getint('copy.staging_songs', 'maxerror', fallback=10)}
+{copy_option('copy.staging_songs', 'compupdate')}
+STATUPDATE {parser.get('copy.staging_songs', 'statupdate', fallback='OFF')}
+{{manifest}}
+"""
+
+# LOAD ERRORS
+
+load_errors_select = """
+SELECT query, 
+       TRIM(filename), 
+       line_number, 
+       TRIM(colname), 
+       err_code, 
+       TRIM(err_reason), 
+       TRIM(raw_field_value)
+FROM stl_load_errors
+WHERE session = pg_backend_pid() AND query > %(last_query)s
+ORDER BY query, filename, line_number
 """
 
 # FINAL TABLES
 
 songplay_table_insert = """
-INSERT INTO songplays (start_time, user_id, level, song_id, artist_id, session_id, location, user_agent)
+INSERT INTO songplays (start_time, user_id, user_key, level, song_id, artist_id, session_id, location, user_agent)
 SELECT DISTINCT timestamp with time zone 'epoch' + se.ts/1000 * interval '1 second',
        se.userId, 
+       u.user_key, 
        se.level, 
        ss.song_id, 
        ss.artist_id, 
@@ -141,18 +273,88 @@ SELECT DISTINCT timestamp with time zone 'epoch' + se.ts/1000 * interval '1 seco
        se.userAgent
 FROM staging_events AS se INNER JOIN staging_songs AS ss
 ON se.song = ss.title AND se.artist = ss.artist_name AND se.length = ss.duration
+LEFT JOIN users AS u
+ON se.userId = u.user_id
+AND timestamp 'epoch' + se.ts/1000 * interval '1 second' >= u.effective_from
+AND timestamp 'epoch' + se.ts/1000 * interval '1 second' < u.effective_to
 WHERE se.page = 'NextSong'
 """
 
+# users is maintained as slowly changing dimension of type 2: staged events are compared with current
+# version of each user by row hash, and only the points where attributes actually change become new versions
+
+user_changes_table_create = """
+CREATE TEMP TABLE user_changes AS
+SELECT user_id, 
+       first_name, 
+       last_name, 
+       gender, 
+       level, 
+       row_hash, 
+       effective_from
+FROM (
+    SELECT user_id, 
+           first_name, 
+           last_name, 
+           gender, 
+           level, 
+           row_hash, 
+           effective_from, 
+           is_existing, 
+           LAG(row_hash) OVER (PARTITION BY user_id ORDER BY effective_from, row_hash) AS previous_hash
+    FROM (
+        SELECT user_id, 
+               first_name, 
+               last_name, 
+               gender, 
+               level, 
+               row_hash, 
+               effective_from, 
+               TRUE AS is_existing
+        FROM users
+        WHERE is_current
+        UNION ALL
+        SELECT se.userId, 
+               se.firstName, 
+               se.lastName, 
+               se.gender, 
+               se.level, 
+               MD5(COALESCE(se.firstName, '') || '|' || COALESCE(se.lastName, '') || '|' || COALESCE(se.gender, '') || '|' || COALESCE(se.level, '')), 
+               timestamp 'epoch' + se.ts/1000 * interval '1 second', 
+               FALSE
+        FROM staging_events AS se LEFT JOIN users AS u
+        ON se.userId = u.user_id AND u.is_current
+        WHERE se.page = 'NextSong' AND se.userId IS NOT NULL
+        AND (u.user_id IS NULL OR timestamp 'epoch' + se.ts/1000 * interval '1 second' > u.effective_from)
+    ) AS versions
+) AS sequenced
+WHERE NOT is_existing AND (previous_hash IS NULL OR previous_hash <> row_hash)
+"""
+
+user_table_close = """
+UPDATE users
+SET effective_to = uc.effective_from, 
+    is_current = FALSE
+FROM (
+    SELECT user_id, MIN(effective_from) AS effective_from
+    FROM user_changes
+    GROUP BY user_id
+) AS uc
+WHERE users.user_id = uc.user_id AND users.is_current
+"""
+
 user_table_insert = """
-INSERT INTO users (user_id, first_name, last_name, gender, level)
-SELECT DISTINCT userId, 
-       firstName, 
-       lastName, 
+INSERT INTO users (user_id, first_name, last_name, gender, level, row_hash, effective_from, effective_to, is_current)
+SELECT user_id, 
+       first_name, 
+       last_name, 
        gender, 
-       level
-FROM staging_events
-WHERE page = 'NextSong' AND userId IS NOT NULL
+       level, 
+       row_hash, 
+       effective_from, 
+       COALESCE(LEAD(effective_from) OVER (PARTITION BY user_id ORDER BY effective_from, row_hash), '9999-12-31'::TIMESTAMP), 
+       LEAD(effective_from) OVER (PARTITION BY user_id ORDER BY effective_from, row_hash) IS NULL
+FROM user_changes
 """
 
 song_table_insert = """
@@ -191,7 +393,24 @@ FROM songplays
 
 # QUERY LISTS
 
-create_table_queries = [staging_events_table_create, staging_songs_table_create, songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create]
+create_table_queries = [staging_events_table_create, staging_songs_table_create, songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create, load_version_table_create]
 drop_table_queries = [staging_events_table_drop, staging_songs_table_drop, songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop]
 copy_table_queries = [staging_events_copy, staging_songs_copy]
-insert_table_queries = [songplay_table_insert, user_table_insert, song_table_insert, artist_table_insert, time_table_insert]
+# each item is committed as one transaction; type-2 load of users has to be atomic, so that closed versions are
+# never visible without their successors, and it has to precede songplays, which looks up the version effective at each play
+user_table_load_queries = [user_changes_table_drop, user_changes_table_create, user_table_close, user_table_insert, user_changes_table_drop]
+insert_table_queries = [user_table_load_queries, [songplay_table_insert], [song_table_insert], [artist_table_insert], [time_table_insert]]
+create_view_queries = [hourly_plays_view_create, song_plays_view_create, level_activity_view_create]
+drop_view_queries = [hourly_plays_view_drop, song_plays_view_drop, level_activity_view_drop]
+
+# MATERIALIZED VIEW REGISTRY
+# maps each materialized view to the base tables it reads, so that only views over changed tables get refreshed
+
+materialized_views = {
+    "hourly_plays": ["songplays", "time"],
+    "song_plays": ["songplays", "songs"],
+    "level_activity": ["songplays", "users"],
+}
+
+# materialized views carry load versions of their own, bumped when they are refreshed
+versioned_tables = ["staging_events", "staging_songs", "songplays", "users", "songs", "artists", "time"] + list(materialized_views)
@@ -0,0 +1,60 @@
+import benchmark
+import boto3
+import logging
+import os
+import pytest
+import time
+
+from moto import mock_aws
+
+
+@pytest.fixture
+def aws(tmp_path, monkeypatch) -> boto3.Session:
+    """
+    replace AWS with moto and keep configuration file of the benchmark inside temporary working directory
+    """
+    for key in ["AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "AWS_SESSION_TOKEN"]:
+        monkeypatch.setenv(key, "testing")
+    monkeypatch.setenv("MOTO_IAM_LOAD_MANAGED_POLICIES", "true")
+    monkeypatch.setattr(benchmark, "CONFIG_FILE_PATH", str(tmp_path / "dwh.cfg"))
+    monkeypatch.chdir(tmp_path)
+    with mock_aws():
+        yield boto3.Session(region_name=benchmark.DEFAULT_CONFIG["DEFAULT"]["region"])
+
+
+def test_run_shape_dry_run_records_jobs_and_tears_down(aws, monkeypatch):
+    conn = benchmark.LocalConnection()
+    monkeypatch.setattr(benchmark, "LocalConnection", lambda: conn)
+    sleeps = []
+    monkeypatch.setattr(time, "sleep", sleeps.append)
+
+    result = benchmark.run_shape(
+        {"node_type": "dc2.large", "node_count": 2},
+        {"hourly_price": {"dc2.large": 0.25}},
+        "homer.simpson",
+        "Doh!nuts123",
+        logging.getLogger(__name__),
+        dry_run=True
+    )
+
+    assert result["status"] == "succeeded", result["error"]
+    assert set(sleeps) <= {0}
+    assert list(result["timings"]) == [
+        "provision", "create_tables", "load_staging_tables", "insert_tables", "refresh_views", "teardown"
+    ]
+    assert set(result["load_report"]) == {"staging_events", "staging_songs"}
+    statements = [" ".join(statement.split()) for statement in conn.statements]
+    assert statements.index("DROP MATERIALIZED VIEW IF EXISTS hourly_plays") < statements.index("DROP TABLE IF EXISTS songplays")
+    assert statements.index("DROP TABLE IF EXISTS songplays") < statements.index(next(
+        statement for statement in statements if statement.startswith("CREATE TABLE IF NOT EXISTS songplays")
+    ))
+    assert any(statement.startswith("CREATE MATERIALIZED VIEW hourly_plays") for statement in statements)
+    assert any(statement.startswith("COPY staging_events FROM 's3://udacity-dend/log-data'") for statement in statements)
+    assert any(statement.startswith("INSERT INTO songplays") for statement in statements)
+
+    assert aws.client("redshift").describe_clusters()["Clusters"] == []
+    assert aws.client("redshift").describe_cluster_subnet_groups()["ClusterSubnetGroups"] == []
+    role_name = benchmark.DEFAULT_CONFIG["iam.role"]["name"]
+    assert role_name not in [role["RoleName"] for role in aws.client("iam").list_roles()["Roles"]]
+    assert [vpc for vpc in aws.client("ec2").describe_vpcs()["Vpcs"] if not vpc["IsDefault"]] == []
+    assert not os.path.exists(benchmark.CONFIG_FILE_PATH)
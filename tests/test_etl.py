@@ -0,0 +1,148 @@
+import importlib
+import logging
+import pytest
+
+
+@pytest.fixture
+def etl(project_config):
+    # Modules are reloaded since sql_queries reads dwh.cfg of the working directory only on import
+    importlib.reload(importlib.import_module("sql_queries"))
+
+    return importlib.reload(importlib.import_module("etl"))
+
+
+class RecordingConnection:
+    """
+    stand-in of both psycopg2 connection and cursor, which records executed statements and commits,
+    reporting given number of changed rows for each target table
+    """
+
+    def __init__(self, etl, rowcounts: dict):
+        self.etl = etl
+        self.rowcounts = rowcounts
+        self.statements = []
+        self.rowcount = -1
+
+    def execute(self, query: str, params: dict = None):
+        self.statements.append(query if params is None else (query, params))
+        self.rowcount = self.rowcounts.get(self.etl.get_target_table(query), 0)
+
+    def commit(self):
+        self.statements.append("COMMIT")
+
+
+@pytest.fixture
+def staging_songs_copy(etl, project_config, monkeypatch) -> list:
+    """
+    script COPY attempts into staging_songs, where files under s3://bucket/bad* fail the whole COPY
+    one file at a time as MAXERROR would, and return the list of loaded sources
+    """
+    project_config["copy.staging_songs"]["manifest_prefix"] = "s3://manifests/sparkify"
+    monkeypatch.setattr(etl, "copy_table_queries", [etl.copy_table_queries[1]])
+    monkeypatch.setattr(etl, "list_source_files", lambda session, source: [
+        "s3://bucket/bad-1.json", "s3://bucket/good-1.json", "s3://bucket/bad-2.json", "s3://bucket/good-2.json",
+    ])
+    manifests = {}
+    monkeypatch.setattr(etl, "write_manifest", lambda session, url, files: manifests.setdefault(url, files) and url)
+    attempts, pending_errors = [], []
+
+    def copy_table(cur, conn, query, source, manifest=False):
+        files = manifests.pop(source) if manifest else etl.list_source_files(None, source)
+        bad_files = [file for file in files if "bad" in file]
+        attempts.append(files)
+        if bad_files:
+            pending_errors.append({"query": len(attempts), "filename": bad_files[0]})
+        return not bad_files
+
+    def fetch_load_errors(cur, last_query):
+        errors = [error for error in pending_errors if error["query"] > last_query]
+        pending_errors.clear()
+        return errors
+
+    monkeypatch.setattr(etl, "copy_table", copy_table)
+    monkeypatch.setattr(etl, "fetch_load_errors", fetch_load_errors)
+
+    return attempts
+
+
+def test_load_staging_tables_retries_until_no_new_failed_file(etl, project_config, staging_songs_copy):
+    report = {}
+    etl.load_staging_tables(None, None, project_config, None, logging.getLogger(__name__), report)
+
+    assert staging_songs_copy[:3] == [
+        ["s3://bucket/bad-1.json", "s3://bucket/good-1.json", "s3://bucket/bad-2.json", "s3://bucket/good-2.json"],
+        ["s3://bucket/good-1.json", "s3://bucket/bad-2.json", "s3://bucket/good-2.json"],
+        ["s3://bucket/good-1.json", "s3://bucket/good-2.json"],
+    ]
+    assert report["staging_songs"]["status"] == "partial"
+    assert report["staging_songs"]["rejected_files"] == ["s3://bucket/bad-1.json", "s3://bucket/bad-2.json"]
+    assert len(report["staging_songs"]["errors"]) == 4
+
+
+def test_configuration_without_copy_sections_falls_back_to_defaults(project_config, monkeypatch):
+    for section in ["copy.staging_events", "copy.staging_songs", "cache"]:
+        project_config.remove_section(section)
+    with open("dwh.cfg", "w") as file:
+        project_config.write(file)
+    sql_queries = importlib.reload(importlib.import_module("sql_queries"))
+    etl = importlib.reload(importlib.import_module("etl"))
+    sources = []
+    monkeypatch.setattr(etl, "copy_table", lambda cur, conn, query, source, manifest=False: sources.append(source) or True)
+    monkeypatch.setattr(etl, "fetch_load_errors", lambda cur, last_query: [])
+
+    etl.load_staging_tables(None, None, project_config, None, logging.getLogger(__name__), {})
+
+    assert "MAXERROR 10\n\nSTATUPDATE OFF" in sql_queries.staging_events_copy
+    assert sources == ["s3://udacity-dend/log-data", "s3://udacity-dend/song-data"]
+
+
+def test_insert_tables_commits_type_2_load_of_users_as_one_transaction(etl):
+    conn = RecordingConnection(etl, {"users": 2, "songplays": 5})
+
+    changed_tables = etl.insert_tables(conn, conn)
+
+    assert changed_tables == {"users", "songplays"}
+    users_load = conn.statements[:conn.statements.index("COMMIT") + 1]
+    assert users_load == [
+        *etl.insert_table_queries[0],
+        (etl.load_version_bump, {"table_name": "users"}),
+        "COMMIT",
+    ]
+    assert conn.statements.count("COMMIT") == len(etl.insert_table_queries)
+
+
+def test_configured_compupdate_is_added_to_copy(project_config):
+    project_config["copy.staging_songs"]["compupdate"] = "OFF"
+    with open("dwh.cfg", "w") as file:
+        project_config.write(file)
+    sql_queries = importlib.reload(importlib.import_module("sql_queries"))
+
+    assert "COMPUPDATE" not in sql_queries.staging_events_copy
+    assert "MAXERROR 10\nCOMPUPDATE OFF\nSTATUPDATE OFF" in sql_queries.staging_songs_copy
+
+
+@pytest.mark.parametrize("rowcounts, refreshed_views", [
+    ({"songs": 3, "artists": 2}, ["song_plays"]),
+    ({"users": 1}, ["level_activity"]),
+    ({"songplays": 4, "time": 4}, ["hourly_plays", "song_plays", "level_activity"]),
+    ({}, []),
+])
+def test_refresh_views_only_refreshes_and_bumps_views_over_changed_tables(etl, rowcounts, refreshed_views):
+    conn = RecordingConnection(etl, rowcounts)
+    changed_tables = etl.insert_tables(conn, conn)
+    bumps = [statement[1]["table_name"] for statement in conn.statements if isinstance(statement, tuple)]
+    conn.statements.clear()
+
+    etl.refresh_views(conn, conn, changed_tables, logging.getLogger(__name__))
+
+    assert changed_tables == set(rowcounts)
+    assert sorted(bumps) == sorted(rowcounts)
+    assert conn.statements == [
+        statement
+        for view in refreshed_views
+        for statement in [
+            etl.materialized_view_refresh.format(view),
+            (etl.load_version_bump, {"table_name": view}),
+            "COMMIT",
+        ]
+    ]
@@ -0,0 +1,158 @@
+import datetime
+import gzip
+import importlib
+import json
+import pytest
+
+from decimal import Decimal
+
+
+@pytest.fixture
+def query_cache(project_config):
+    # Modules are reloaded since sql_queries reads dwh.cfg of the working directory only on import
+    importlib.reload(importlib.import_module("sql_queries"))
+
+    return importlib.reload(importlib.import_module("query_cache"))
+
+
+@pytest.mark.parametrize("sql, expected", [
+    ("SELECT * FROM songplays", {"songplays"}),
+    ("SELECT hour, SUM(play_count) FROM hourly_plays GROUP BY hour", {"hourly_plays"}),
+    ("SELECT * FROM songplays sp JOIN users u ON sp.user_key = u.user_key", {"songplays", "users"}),
+    ("SELECT * FROM songplays sp, users u WHERE sp.user_key = u.user_key", {"songplays", "users"}),
+    ("SELECT * FROM songplays AS sp, users AS u, time WHERE sp.start_time = time.start_time", {"songplays", "users", "time"}),
+    ("WITH x AS (SELECT * FROM songs) SELECT * FROM x, artists", {"songs", "artists"}),
+    ("SELECT * FROM (SELECT song_id FROM songplays) AS sp, songs s WHERE sp.song_id = s.song_id", {"songplays", "songs"}),
+    ("SELECT * FROM songs WHERE artist_id IN (SELECT artist_id FROM artists)", {"songs", "artists"}),
+    ("SELECT extract(hour from start_time), COUNT(*) FROM songplays GROUP BY 1", {"songplays"}),
+    ("SELECT * FROM users WHERE first_name = 'from pg_tables'", {"users"}),
+])
+def test_get_source_tables(query_cache, sql, expected):
+    assert query_cache.get_source_tables(query_cache.normalize_sql(sql)) == expected
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM pg_tables",
+    "SELECT * FROM songplays, pg_tables",
+    "SELECT * FROM songplays sp, (SELECT * FROM stl_load_errors) AS e",
+    "SELECT * FROM songs s JOIN svv_table_info t ON s.title = t.table",
+])
+def test_get_source_tables_skips_untracked_relations(query_cache, sql):
+    assert query_cache.get_source_tables(query_cache.normalize_sql(sql)) is None
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM songplays WHERE start_time > GETDATE() - interval '1 day'",
+    "SELECT level, current_date FROM users",
+    "SELECT * FROM songs ORDER BY RANDOM() LIMIT 10",
+])
+def test_get_source_tables_skips_volatile_functions(query_cache, sql):
+    assert query_cache.get_source_tables(query_cache.normalize_sql(sql)) is None
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM songplays; DROP TABLE users",
+    "INSERT INTO songs SELECT * FROM songs",
+    "SELECT * INTO songs_backup FROM songs",
+    "WITH stale AS (SELECT user_id FROM users) DELETE FROM users USING stale",
+    "TRUNCATE songplays",
+])
+def test_query_rejects_statements_other_than_single_select(query_cache, project_config, warehouse, sql):
+    cache = query_cache.QueryCache(project_config)
+    with pytest.raises(ValueError):
+        cache.query(sql)
+    assert warehouse["executed"] == 0
+
+
+class FakeCursor:
+    """
+    cursor answering load version lookups from given versions and any other query with given rows
+    """
+
+    def __init__(self, warehouse: dict):
+        self.warehouse = warehouse
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, sql: str, params: dict = None):
+        self.is_version_lookup = "load_versions" in sql
+        if not self.is_version_lookup:
+            self.warehouse["executed"] += 1
+            self.description = [type("Column", (), {"name": name}) for name in self.warehouse["columns"]]
+
+    def fetchall(self) -> list:
+        if self.is_version_lookup:
+            return list(self.warehouse["versions"].items())
+        return self.warehouse["rows"]
+
+
+class FakeConnection:
+    def __init__(self, warehouse: dict):
+        self.warehouse = warehouse
+
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self.warehouse)
+
+
+@pytest.fixture
+def warehouse(query_cache, monkeypatch) -> dict:
+    warehouse = {
+        "versions": {"songplays": 1},
+        "columns": ["start_time", "level", "play_count", "share"],
+        "rows": [
+            (datetime.datetime(2018, 11, 1, 21, 1, 46), "free", 3, Decimal("0.25")),
+            (datetime.datetime(2018, 11, 2, 9, 0, 0), None, 1, None),
+        ],
+        "executed": 0,
+    }
+    monkeypatch.setattr(query_cache.psycopg2, "connect", lambda db_info: FakeConnection(warehouse))
+
+    return warehouse
+
+
+def test_query_persists_columns_as_json_and_drops_stale_files(query_cache, project_config, warehouse, tmp_path):
+    sql = "SELECT start_time, level, COUNT(*), SUM(share) FROM songplays GROUP BY 1, 2"
+    query_cache.QueryCache(project_config, cache_dir=str(tmp_path / "cache")).query(sql)
+    files = list((tmp_path / "cache").iterdir())
+    assert [file.name.endswith(".json.gz") for file in files] == [True]
+    with gzip.open(files[0], "rt") as file:
+        assert json.load(file)["values"][0][0] == "datetime"
+
+    # A new client answers from disk with the original value types
+    columns, rows = query_cache.QueryCache(project_config, cache_dir=str(tmp_path / "cache")).query(sql)
+    assert warehouse["executed"] == 1
+    assert (columns, rows) == (warehouse["columns"], warehouse["rows"])
+
+    # Stale file is deleted even when the new result cannot be persisted
+    warehouse["versions"]["songplays"] = 2
+    warehouse["rows"] = [(memoryview(b"raw"), "free", 1, None)]
+    query_cache.QueryCache(project_config, cache_dir=str(tmp_path / "cache")).query(sql)
+    assert warehouse["executed"] == 2
+    assert list((tmp_path / "cache").iterdir()) == []
+
+
+def test_write_entry_evicts_least_recently_used_files(query_cache, project_config, warehouse, tmp_path):
+    cache = query_cache.QueryCache(project_config, max_bytes=1024, cache_dir=str(tmp_path / "cache"))
+    for limit in range(30):
+        cache.query(f"SELECT * FROM songplays LIMIT {limit}")
+        cache.entries.clear()
+        cache.size = 0
+
+    sizes = [file.stat().st_size for file in (tmp_path / "cache").iterdir()]
+    assert 0 < len(sizes) < 30
+    assert sum(sizes) <= 1024
+
+
+def test_query_sends_volatile_queries_to_warehouse_every_time(query_cache, project_config, warehouse):
+    cache = query_cache.QueryCache(project_config)
+    for _ in range(2):
+        cache.query("SELECT * FROM songplays WHERE start_time > GETDATE() - interval '1 day'")
+    cache.query("SELECT * FROM users WHERE first_name = 'getdate; drop'")
+    cache.query("SELECT * FROM users WHERE first_name = 'getdate; drop'")
+
+    assert warehouse["executed"] == 3
+    assert len(cache.entries) == 1
@@ -0,0 +1,130 @@
+import hashlib
+import importlib
+import re
+import sqlite3
+import pytest
+
+
+@pytest.fixture
+def sql_queries(project_config):
+    # Module is reloaded since it reads dwh.cfg of the working directory only on import
+    return importlib.reload(importlib.import_module("sql_queries"))
+
+
+def to_sqlite(query: str) -> str:
+    """
+    translate Redshift-specific expressions of given query into SQLite, leaving window logic untouched
+    """
+    query = re.sub(
+        r"timestamp (?:with time zone )?'epoch' \+ (se\.)?ts/1000 \* interval '1 second'",
+        r"datetime(\1ts/1000, 'unixepoch')",
+        query
+    )
+    query = query.replace("'9999-12-31'::TIMESTAMP", "'9999-12-31 00:00:00'")
+
+    return query.replace("INT IDENTITY(0, 1) PRIMARY KEY", "INTEGER PRIMARY KEY")
+
+
+@pytest.fixture
+def warehouse(sql_queries):
+    """
+    SQLite database with staging, users and songplays tables, and a function loading given events through
+    the type-2 users load and songplays insertion as etl.py runs them
+    """
+    conn = sqlite3.connect(":memory:")
+    conn.create_function("MD5", 1, lambda value: hashlib.md5(value.encode()).hexdigest())
+    for query in [
+        sql_queries.staging_events_table_create,
+        sql_queries.staging_songs_table_create,
+        sql_queries.user_table_create,
+        sql_queries.songplay_table_create,
+    ]:
+        conn.execute(to_sqlite(query))
+    conn.execute(
+        "INSERT INTO staging_songs (song_id, title, artist_id, artist_name, duration) "
+        "VALUES ('SO1', 'Song', 'AR1', 'Artist', 200.0)"
+    )
+
+    def load(events: list):
+        conn.execute("DELETE FROM staging_events")
+        conn.executemany(
+            "INSERT INTO staging_events (userId, firstName, lastName, gender, level, ts, page, song, artist, length) "
+            "VALUES (?, 'Lily', 'Koch', 'F', ?, ?, 'NextSong', 'Song', 'Artist', 200.0)",
+            [(user_id, level, seconds * 1000) for user_id, level, seconds in events]
+        )
+        for queries in sql_queries.insert_table_queries[:2]:
+            for query in queries:
+                conn.execute(to_sqlite(query))
+        conn.commit()
+
+    yield conn, load
+    conn.close()
+
+
+def get_versions(conn, user_id: int) -> list:
+    return conn.execute(
+        "SELECT level, effective_from, effective_to, is_current FROM users WHERE user_id = ? ORDER BY user_key",
+        (user_id,)
+    ).fetchall()
+
+
+def test_users_are_loaded_before_songplays_within_one_transaction(sql_queries):
+    assert sql_queries.insert_table_queries[0] == [
+        sql_queries.user_changes_table_drop,
+        sql_queries.user_changes_table_create,
+        sql_queries.user_table_close,
+        sql_queries.user_table_insert,
+        sql_queries.user_changes_table_drop,
+    ]
+    assert sql_queries.insert_table_queries[1] == [sql_queries.songplay_table_insert]
+
+
+def test_users_versions_follow_change_points_across_loads(warehouse):
+    conn, load = warehouse
+    # Upgrade and downgrade within one load, with a repeated level that is not a change point
+    load([(1, "free", 1000), (1, "free", 1500), (1, "paid", 2000), (1, "free", 3000)])
+    # Late event before current version only gets its play, and upgrade closes current version
+    load([(1, "paid", 2500), (1, "paid", 6000), (1, "paid", 7000)])
+
+    assert get_versions(conn, 1) == [
+        ("free", "1970-01-01 00:16:40", "1970-01-01 00:33:20", 0),
+        ("paid", "1970-01-01 00:33:20", "1970-01-01 00:50:00", 0),
+        ("free", "1970-01-01 00:50:00", "1970-01-01 01:40:00", 0),
+        ("paid", "1970-01-01 01:40:00", "9999-12-31 00:00:00", 1),
+    ]
+
+
+def test_users_versions_stay_contiguous_with_events_at_same_time(warehouse):
+    conn, load = warehouse
+    load([(2, "free", 4000), (2, "paid", 5000), (2, "free", 5000)])
+    load([(2, "paid", 5000), (2, "free", 8000)])
+
+    versions = get_versions(conn, 2)
+    assert [is_current for *_, is_current in versions].count(1) == 1
+    assert versions[-1][2] == "9999-12-31 00:00:00"
+    assert all(previous[2] == following[1] for previous, following in zip(versions, versions[1:]))
+    assert versions[0][:2] == ("free", "1970-01-01 01:06:40")
+    assert versions[-1][0] == "free"
+    # Event replayed at effective_from of current version adds no version
+    assert [version[:2] for version in versions].count(("paid", "1970-01-01 01:23:20")) == 1
+
+
+def test_songplays_refer_to_exactly_one_version_effective_at_play(warehouse):
+    conn, load = warehouse
+    load([(1, "free", 1000), (1, "paid", 2000), (1, "free", 3000), (2, "free", 4000), (2, "paid", 5000), (2, "free", 5000)])
+    load([(1, "paid", 2500), (1, "paid", 6000)])
+
+    plays = conn.execute(
+        "SELECT sp.user_id, sp.start_time, sp.level, sp.user_key, u.level "
+        "FROM songplays AS sp LEFT JOIN users AS u ON sp.user_key = u.user_key ORDER BY sp.songplay_id"
+    ).fetchall()
+    assert len(plays) == 8
+    assert all(user_key is not None for _, _, _, user_key, _ in plays)
+    # Level of each play of user 1 matches version it refers to, late play included
+    assert all(play_level == user_level for user_id, _, play_level, _, user_level in plays if user_id == 1)
+    # Plays at the same time refer to the same version, which is the one in effect after that time
+    same_time_keys = {user_key for user_id, start_time, _, user_key, _ in plays if user_id == 2 and start_time.startswith("1970-01-01 01:23:20")}
+    assert len(same_time_keys) == 1
+    assert conn.execute(
+        "SELECT effective_from FROM users WHERE user_key = ?", (same_time_keys.pop(),)
+    ).fetchone() == ("1970-01-01 01:23:20",)